@@ -1,57 +1,178 @@
 #!/usr/bin/env python3.13t
 import argparse
+import atexit
 import concurrent.futures
+import functools
+import itertools
 import logging
+import multiprocessing
 import os
 import re
+import shutil
 import sys
+import sysconfig
+import tempfile
+import threading
 import time
-from pathlib import Path
-from queue import Queue
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 try:
     import pydicom
+    from pydicom.datadict import dictionary_VR
+    from pydicom.tag import Tag
     from tqdm import tqdm
 except ImportError:
     print("Error: pydicom and tqdm are required. Please install them using pip.")
     sys.exit(1)
 
+# Files per ProcessPoolExecutor task, amortizes pickling/IPC overhead. Kept modest since the
+# total is unknown while discovery streams, and small trees should still use every worker.
+PROCESS_CHUNKSIZE = 16
+
+# String-like VRs that SAR operates on
+_STRING_VRS = frozenset({'SH', 'LO', 'ST', 'LT', 'UT', 'PN', 'AE', 'CS', 'AS', 'DA', 'DT', 'TM', 'UI', 'UR'})
+
+# Characters that give a pattern regex meaning; without any of them it matches literally
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+# Dump stops reading here unless the requested tag lies at or beyond it
+_PIXEL_DATA_TAG = 0x7FE00010
+
+# Suffix of save_replacing's in-flight temp files; discovery runs concurrently with
+# the workers, so it must not pick these up
+_TEMP_SUFFIX = '.dicom_sar.tmp'
+
+# Tag argument parsing: a keyword like "PatientID", or hex parts separated by commas/spaces
+_TAG_KEYWORD_RE = re.compile(r'^[a-zA-Z]+$')
+_TAG_SPLIT_RE = re.compile(r'[,\s]+')
+
 # Configure logging
-def setup_logging(verbose=False):
+def setup_logging(verbose=False, log_queue=None):
+    """Configure logging; file handlers run on a QueueListener thread.
+
+    Loggers put records on log_queue, so workers never block on handler locks or
+    file writes. Pass a multiprocessing queue when worker processes log too. Only
+    the main thread prints to the console directly, which keeps its messages in
+    order with the summary; worker output is printed by the listener. The listener
+    is stopped at exit, flushing any queued records.
+
+    Returns (logger, error_logger, listener).
+    """
     log_level = logging.DEBUG if verbose else logging.INFO
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler('dicom_sar.log')
-        ]
-    )
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    main_pid, main_thread = os.getpid(), threading.get_ident()
+    is_main = lambda record: record.process == main_pid and record.thread == main_thread
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.addFilter(is_main)
+    worker_stream_handler = logging.StreamHandler(sys.stdout)
+    worker_stream_handler.addFilter(lambda record: not is_main(record))
+    file_handler = logging.FileHandler('dicom_sar.log')
+    # Separate file for errors, only fed by the error logger
+    error_handler = logging.FileHandler('errors.log')
+    error_handler.addFilter(logging.Filter('dicom_errors'))
+    for handler in (stream_handler, worker_stream_handler, file_handler, error_handler):
+        handler.setFormatter(formatter)
+
+    if log_queue is None:
+        log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, worker_stream_handler, file_handler, error_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger, error_logger = attach_log_queue(log_queue, log_level)
+    logging.getLogger().addHandler(stream_handler)
+    return logger, error_logger, listener
+
+def attach_log_queue(log_queue, log_level):
+    """Route this process's logging through a QueueHandler on log_queue."""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(log_level)
     # Create a separate logger for errors
     error_logger = logging.getLogger('dicom_errors')
     error_logger.setLevel(logging.ERROR)
-    error_handler = logging.FileHandler('errors.log')
-    error_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    error_logger.addHandler(error_handler)
     return logging.getLogger(__name__), error_logger
 
+def gil_enabled():
+    """Return True if the interpreter runs with the GIL (i.e. not a 3.13t free-threaded build)."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    if is_gil_enabled is not None:
+        return is_gil_enabled()
+    return not sysconfig.get_config_var("Py_GIL_DISABLED")
+
+# Per-process state for ProcessPoolExecutor workers, filled in by init_worker
+_worker_state = {}
+
+def init_worker(args, log_queue):
+    """Initialize a worker process: keep args and loggers around for every task it runs."""
+    # Records go back to the parent's listener, which owns the log files
+    logger, error_logger = attach_log_queue(log_queue, logging.DEBUG if args.verbose else logging.INFO)
+    _worker_state["args"] = args
+    _worker_state["logger"] = logger
+    _worker_state["error_logger"] = error_logger
+    # Compile the search pattern once per worker rather than once per file
+    _worker_state["search_re"] = re.compile(args.regex_search) if args.sar else None
+
+def process_in_worker(file_paths):
+    """ProcessPoolExecutor entry point. Only the small (success, modified) tuples go back to the parent."""
+    return process_batch(
+        file_paths, _worker_state["args"], _worker_state["logger"], _worker_state["error_logger"],
+        _worker_state["search_re"]
+    )
+
+def batched(iterable, n):
+    """Yield lists of up to n items from iterable."""
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+def submit_bounded(executor, task, batches, window):
+    """Submit task(batch) for every batch while keeping at most `window` tasks in flight.
+
+    Yields (future, batch) pairs as they complete, so the number of live futures
+    stays bounded no matter how many files there are.
+    """
+    pending = {}
+    for batch in batches:
+        if len(pending) >= window:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future, pending.pop(future)
+        pending[executor.submit(task, batch)] = batch
+    for future in concurrent.futures.as_completed(pending):
+        yield future, pending[future]
+
 def find_dicom_files(root_dir):
-    """Recursively find all files in the directory using rglob."""
+    """Recursively yield all files under root_dir as they are found."""
     # Architecture says: Recursive glob ('rglob') for *.* (as these dicom files are missing extension).
-    # We will simply walk everything or use rglob("*").
-    path = Path(root_dir)
-    if not path.exists():
+    # We match every file instead. os.scandir is used over rglob since DirEntry caches
+    # the file type, and yielding lazily lets workers start before the walk finishes.
+    if os.path.isfile(root_dir):
+        yield str(root_dir)
         return
-    
-    if path.is_file():
-        yield str(path)
+
+    if not os.path.isdir(root_dir):
         return
 
-    # Use rglob to find all files
-    for p in path.rglob("*"):
-        if p.is_file():
-            yield str(p)
+    stack = [root_dir]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # Unreadable directory, skip it
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and not entry.name.endswith(_TEMP_SUFFIX):
+                    yield entry.path
 
+@functools.lru_cache(maxsize=256)
 def parse_tag(tag_str):
     """Parse a DICOM tag string into a tuple (group, element) or keyword."""
     if not tag_str:
@@ -61,12 +182,12 @@ def parse_tag(tag_str):
     clean_tag = tag_str.replace("(", "").replace(")", "").strip()
     
     # Check if it's a keyword (e.g., "PatientID")
-    if re.match(r'^[a-zA-Z]+$', clean_tag):
+    if _TAG_KEYWORD_RE.match(clean_tag):
         return clean_tag
     
     # Check for hex format (e.g., "0010,0010" or "10,20")
     # Splits by comma or space
-    parts = re.split(r'[,\s]+', clean_tag)
+    parts = _TAG_SPLIT_RE.split(clean_tag)
     if len(parts) == 2:
         try:
             return (int(parts[0], 16), int(parts[1], 16))
@@ -75,6 +196,14 @@ def parse_tag(tag_str):
             
     raise argparse.ArgumentTypeError(f"Invalid tag format: {tag_str}")
 
+def before_pixel_data(tag):
+    """Return True if tag sorts before PixelData, so reading can stop there."""
+    try:
+        return Tag(tag) < _PIXEL_DATA_TAG
+    except ValueError:
+        # Unknown keyword, there is nothing to find past PixelData either
+        return True
+
 def dump_file(ds, tag_filter=None, logger=None):
     """Dump DICOM header information."""
     if tag_filter:
@@ -92,15 +221,60 @@ def dump_file(ds, tag_filter=None, logger=None):
     else:
         print(ds)
 
+def walk_string_elems(ds):
+    """Yield every string-VR element in ds, descending into sequences.
+
+    Replaces ds.iterall(), which recurses through nested generators (one frame per
+    sequence item); an explicit stack keeps the hot loop flat. VRs are read from the
+    raw entries so deferred values that are skipped are never loaded from disk.
+    """
+    stack = deque([ds])
+    while stack:
+        dataset = stack.pop()
+        raw_elements = dataset._dict
+        for tag in sorted(raw_elements):
+            vr = raw_elements[tag].VR
+            if vr is None or vr == 'UN':
+                # Implicit VR, or stored as UN: pydicom converts known tags to their
+                # dictionary VR on access. Unknown private tags need the full conversion.
+                try:
+                    vr = dictionary_VR(tag)
+                except KeyError:
+                    vr = dataset[tag].VR
+            if vr in _STRING_VRS:
+                yield dataset[tag]
+            elif vr == 'SQ':
+                stack.extend(dataset[tag].value)
+
+def literal_pattern(search_regex, replace_regex):
+    """Return the search string if the substitution is a plain literal replace, else None.
+
+    Anonymization patterns are often literals (e.g. a hospital name), for which
+    str.replace is much faster than running the regex engine.
+    """
+    if not search_regex or _REGEX_METACHARS.intersection(search_regex):
+        return None
+    # Backslashes in the replacement are escapes/backreferences for re.sub
+    if not isinstance(replace_regex, str) or '\\' in replace_regex:
+        return None
+    return search_regex
+
 def sar_file(ds, search_regex, replace_regex, tag_filter=None, logger=None):
-    """Search and replace DICOM tag values."""
+    """Search and replace DICOM tag values. search_regex may be a pattern string or a compiled pattern."""
     modified = False
     try:
+        # No-op for an already compiled pattern
         regex = re.compile(search_regex)
     except re.error as e:
         if logger: logger.error(f"Invalid regex: {e}")
         return False
 
+    literal = literal_pattern(regex.pattern, replace_regex)
+    if literal is not None:
+        substitute = lambda v: v.replace(literal, replace_regex)
+    else:
+        substitute = lambda v: regex.sub(replace_regex, v)
+
     def process_element(elem):
         nonlocal modified
         # Only process string-like VRs
@@ -108,11 +282,11 @@ def sar_file(ds, search_regex, replace_regex, tag_filter=None, logger=None):
         if not hasattr(elem, 'VR'): 
             return
 
-        if elem.VR in ('SH', 'LO', 'ST', 'LT', 'UT', 'PN', 'AE', 'CS', 'AS', 'DA', 'DT', 'TM', 'UI', 'UR'):
+        if elem.VR in _STRING_VRS:
             try:
                 val = elem.value
                 if isinstance(val, str):
-                    new_val = regex.sub(replace_regex, val)
+                    new_val = substitute(val)
                     if new_val != val:
                         elem.value = new_val
                         modified = True
@@ -121,7 +295,7 @@ def sar_file(ds, search_regex, replace_regex, tag_filter=None, logger=None):
                     changed = False
                     for v in val:
                         if isinstance(v, str):
-                            nv = regex.sub(replace_regex, v)
+                            nv = substitute(v)
                             if nv != v:
                                 changed = True
                             new_vals.append(nv)
@@ -140,20 +314,77 @@ def sar_file(ds, search_regex, replace_regex, tag_filter=None, logger=None):
         if elem:
             process_element(elem)
     else:
-        # Iterate over all elements recursively? 
-        # For now, let's iterate top level. If we need recursive (sequences), that's more complex.
-        # Architecture doesn't explicitly mandate Sequence recursion but implied by "Search/Replace".
-        # Let's stick to top-level for simplicity unless needed, or use ds.iterall()
-        for elem in ds.iterall():
+        # Architecture doesn't explicitly mandate Sequence recursion but implied by "Search/Replace",
+        # so walk all string elements including those nested in sequences.
+        for elem in walk_string_elems(ds):
             process_element(elem)
             
     return modified
 
-def process_single_file(file_path, args, logger, error_logger):
+def is_probably_dicom(file_path):
+    """Cheap magic-byte check so non-DICOM files (thumbnails, .DS_Store, logs) skip dcmread."""
+    try:
+        with open(file_path, 'rb') as f:
+            buf = f.read(132)
+    except OSError:
+        return False
+
+    # Part 10 file: 128 byte preamble followed by 'DICM'
+    if buf[128:132] == b'DICM':
+        return True
+
+    # Headerless dataset: first element is in group 0002 or 0008, little or big endian
+    return buf[:2] in (b'\x02\x00', b'\x08\x00', b'\x00\x08')
+
+def save_replacing(ds, file_path):
+    """Atomically replace file_path with ds, via a temporary file in the same directory.
+
+    The original stays untouched until os.replace, so a crash never leaves a
+    half-written file, and deferred values (PixelData) are still read from it
+    while writing. Symlinks are resolved so the file they point to is replaced
+    rather than the link itself.
+    """
+    real_path = os.path.realpath(file_path)
+    directory, name = os.path.split(real_path)
+    tmp = tempfile.NamedTemporaryFile(dir=directory, prefix=f".{name}.", suffix=_TEMP_SUFFIX, delete=False)
+    try:
+        # Write through the already open handle rather than reopening by name
+        with tmp:
+            ds.save_as(tmp)
+        if hasattr(os, "chown"):
+            st = os.stat(real_path)
+            try:
+                os.chown(tmp.name, st.st_uid, st.st_gid)
+            except OSError:
+                # Best effort, only root may hand a file to another owner
+                pass
+        shutil.copymode(real_path, tmp.name)  # temp files are created 0600
+        os.replace(tmp.name, real_path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+def process_single_file(file_path, args, logger, error_logger, search_re=None):
     """Process a single DICOM file based on arguments."""
     try:
+        if not is_probably_dicom(file_path):
+            return False, False
+
         try:
-            ds = pydicom.dcmread(file_path, force=True)
+            if args.dump:
+                # Dump only needs the header, skip PixelData entirely. With --tag,
+                # only that element is decoded; the reader skips over the rest.
+                if args.tag and not before_pixel_data(args.tag):
+                    # Tags at or past PixelData need the full read, deferring large values
+                    ds = pydicom.dcmread(file_path, force=True, defer_size="1 KB", specific_tags=[args.tag])
+                else:
+                    ds = pydicom.dcmread(
+                        file_path, force=True, stop_before_pixels=True,
+                        specific_tags=[args.tag] if args.tag else None
+                    )
+            else:
+                # Large values (PixelData, LUTs) are only read if the file gets saved
+                ds = pydicom.dcmread(file_path, force=True, defer_size="1 KB")
         except Exception as e:
             # Not a DICOM file or corrupt
             # error_logger.debug(f"Skipping {file_path}: {e}")
@@ -169,7 +400,7 @@ def process_single_file(file_path, args, logger, error_logger):
                  logger.error("Regex search pattern required for SAR mode.")
                  return False, False
             
-            modified = sar_file(ds, args.regex_search, args.regex_replace, args.tag, logger)
+            modified = sar_file(ds, search_re or args.regex_search, args.regex_replace, args.tag, logger)
             
             if modified:
                 if args.dry_run:
@@ -177,7 +408,7 @@ def process_single_file(file_path, args, logger, error_logger):
                     return True, False
                 
                 if args.inplace:
-                    ds.save_as(file_path)
+                    save_replacing(ds, file_path)
                     logger.info(f"Modified: {file_path}")
                     return True, True
                 else:
@@ -190,6 +421,10 @@ def process_single_file(file_path, args, logger, error_logger):
         error_logger.error(f"Error processing {file_path}: {e}")
         return False, False
 
+def process_batch(file_paths, args, logger, error_logger, search_re=None):
+    """Process a list of files, returning one (success, modified) tuple per file."""
+    return [process_single_file(f, args, logger, error_logger, search_re) for f in file_paths]
+
 def main():
     parser = argparse.ArgumentParser(description="DICOM Search/Replace & Dump Tool")
     
@@ -213,50 +448,77 @@ def main():
     
     args = parser.parse_args()
     
-    logger, error_logger = setup_logging(args.verbose)
+    # Threads only scale on the free-threaded build; with the GIL, dcmread and
+    # regex work serialize, so fall back to worker processes.
+    use_processes = gil_enabled()
+    
+    # Worker processes need a log queue that crosses process boundaries
+    log_queue = multiprocessing.Queue() if use_processes else SimpleQueue()
+    logger, error_logger, log_listener = setup_logging(args.verbose, log_queue)
     
     if args.sar and not args.regex_search:
         parser.error("--regex_search is required for --sar mode")
-        
-    start_discovery = time.time()
-    files = list(find_dicom_files(args.path))
-    discovery_time = time.time() - start_discovery
-    logger.info(f"Found {len(files)} files in {args.path} (took {discovery_time:.2f}s)")
     
-    if not files:
-        logger.warning("No files found.")
-        return
+    search_re = None
+    if args.sar:
+        try:
+            search_re = re.compile(args.regex_search)
+        except re.error as e:
+            parser.error(f"Invalid --regex_search pattern: {e}")
+        
+    # Discovery is streamed straight into the executor, so the file count is only known at the end
+    files = find_dicom_files(args.path)
 
     # Using max workers formula from architecture
     max_workers = max(1, os.cpu_count() - 4)
-    logger.info(f"Starting execution with {max_workers} workers")
+    
+    if use_processes:
+        logger.info(f"Starting execution with {max_workers} worker processes (GIL enabled)")
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, initializer=init_worker, initargs=(args, log_queue)
+        )
+        task = process_in_worker
+        chunksize = PROCESS_CHUNKSIZE
+    else:
+        logger.info(f"Starting execution with {max_workers} worker threads")
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        task = functools.partial(
+            process_batch, args=args, logger=logger, error_logger=error_logger, search_re=search_re
+        )
+        # No IPC to amortize with threads, one file per task balances best
+        chunksize = 1
     
     start_time = time.time()
     processed_count = 0
     modified_count = 0
     
-    # Use ThreadPoolExecutor
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        futures = {executor.submit(process_single_file, f, args, logger, error_logger): f for f in files}
-        
+    with executor:
         # Use tqdm for progress bar
-        with tqdm(total=len(files), unit="file") as pbar:
-            for future in concurrent.futures.as_completed(futures):
+        with tqdm(unit="file") as pbar:
+            for future, batch in submit_bounded(executor, task, batched(files, chunksize), max_workers * 4):
                 try:
-                    success, modified = future.result()
-                    if success:
-                        processed_count += 1
-                    if modified:
-                        modified_count += 1
+                    for success, modified in future.result():
+                        if success:
+                            processed_count += 1
+                        if modified:
+                            modified_count += 1
                 except Exception as e:
                     error_logger.error(f"Worker exception: {e}")
                 finally:
-                    pbar.update(1)
+                    pbar.update(len(batch))
                     
     end_time = time.time()
     duration = end_time - start_time
     
+    # Drain records still queued by the workers so they print before the summary
+    log_listener.stop()
+    log_listener.start()
+    
+    if not pbar.n:
+        logger.warning(f"No files found in {args.path}.")
+        return
+    
+    logger.info(f"Found {pbar.n} files in {args.path}")
     logger.info(f"Execution complete in {duration:.2f} seconds")
     logger.info(f"Files processed: {processed_count}")
     logger.info(f"Files modified: {modified_count}")
@@ -0,0 +1,58 @@
+# cython: language_level=3
+"""
+Optional Cython build of the SAR hot loop (dicom_sar._sar_elements)
+
+Build in place with: cythonize -i _sar_accel.pyx
+dicom_sar.py imports it when available and otherwise uses the pure Python loop.
+The regex work itself still runs in CPython's C sre engine; this only removes
+interpreter overhead from the per-element dispatch (attribute access,
+isinstance checks and method lookups).
+"""
+
+
+def sar_elements( object elements, object search_re, object literal, str replace,
+                  dict max_lengths, bint dry_run ):
+    """Search/replace over string elements; same contract as dicom_sar._sar_elements"""
+    cdef list changes = [];
+    cdef list too_long = [];
+    cdef list failed = [];
+    cdef object search = search_re.search;
+    cdef object sub = search_re.sub;
+    # Values stay untyped objects: pydicom hands out str subclasses (UID) that a
+    # Cython str declaration would reject
+    cdef object elem, raw, max_len, old_value, new_value;
+    
+    for elem in elements:
+        try:
+            raw = elem.value;
+            if isinstance( raw, bytes ):
+                continue;
+            
+            old_value = raw if isinstance( raw, str ) else str( raw );
+            
+            if literal is not None:
+                if literal not in old_value:
+                    continue;
+                new_value = old_value.replace( literal, replace );
+            else:
+                if search( old_value ) is None:
+                    continue;
+                new_value = sub( replace, old_value );
+            
+            if new_value == old_value:
+                continue;
+            
+            max_len = max_lengths.get( elem.VR );
+            if max_len is not None and len( new_value ) > max_len:
+                too_long.append( elem );
+                continue;
+            
+            if not dry_run:
+                elem.value = new_value;
+            
+            changes.append( ( elem, old_value, new_value ) );
+        
+        except Exception as e:
+            failed.append( ( elem, e ) );
+    
+    return changes, too_long, failed;
@@ -5,19 +5,30 @@ High-performance, multithreaded DICOM file processor using Python 3.13t (Free-Th
 """
 
 import argparse;
+import atexit;
+import itertools;
 import logging;
+import multiprocessing;
 import os;
 import re;
 import shutil;
 import sys;
+import sysconfig;
+import tempfile;
+import threading;
 import time;
-from concurrent.futures import ThreadPoolExecutor, as_completed;
+import uuid;
+from collections import Counter;
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait;
 from datetime import datetime;
+from logging.handlers import QueueHandler, QueueListener;
 from pathlib import Path;
-from typing import List, Optional, Tuple, Dict, Set;
+from queue import SimpleQueue;
+from typing import Iterable, Iterator, List, Optional, Tuple, Dict, Set;
 
 try:
     import pydicom;
+    from pydicom.datadict import dictionary_VR;
     from pydicom.dataelem import DataElement;
     from pydicom.tag import Tag;
     from tqdm import tqdm;
@@ -26,6 +37,12 @@ except ImportError as e:
     print( "Please install requirements: pip install -r requirements.txt" );
     sys.exit( 1 );
 
+# Optional Cython build of _sar_elements (see README); falls back to the pure Python loop
+try:
+    from _sar_accel import sar_elements as _accel_sar_elements;
+except ImportError:
+    _accel_sar_elements = None;
+
 
 # VR (Value Representation) length limits for validation
 VR_MAX_LENGTHS = {
@@ -46,17 +63,224 @@ VR_MAX_LENGTHS = {
     'UT': 4294967294,
 };
 
+# String-based VRs processed by SAR when no --tag is given
+STRING_VRS = frozenset( { 'AE', 'AS', 'CS', 'DA', 'DS', 'DT', 'IS', 'LO', 'LT', 'PN', 'SH', 'ST', 'TM', 'UI' } );
+
+# Binary VRs; dump shows their length instead of stringifying the bytes
+BINARY_VRS = frozenset( { 'OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'UN' } );
+
+# Characters that give a pattern regex meaning; without any of them it matches literally
+REGEX_METACHARS = frozenset( '.^$*+?{}[]\\|()' );
+
+# Tag in lazy hex format: (0010,0020), (0010, 0020), 0010,0020, 10,20, etc.
+TAG_HEX_RE = re.compile( r'\(?\s*([0-9a-fA-F]+)\s*,\s*([0-9a-fA-F]+)\s*\)?' );
+
+# Files per ProcessPoolExecutor task, amortizes pickling/IPC overhead. Kept modest since the
+# total is unknown while discovery streams, and small trees should still use every worker.
+PROCESS_CHUNKSIZE = 16;
+
+# Completed files between progress bar / console flushes, and the max seconds between flushes
+PROGRESS_BATCH = 32;
+FLUSH_INTERVAL = 0.2;
+
+# Dump stops reading here unless a requested tag lies at or beyond it
+PIXEL_DATA_TAG = 0x7FE00010;
+
+# Suffix of _save_replacing's in-flight temp files; discovery runs concurrently with
+# the workers, so it must not pick these up
+TEMP_SUFFIX = '.dicom_sar.tmp';
+
+
+def _gil_enabled() -> bool:
+    """Return True if the interpreter runs with the GIL (i.e. not a 3.13t free-threaded build)"""
+    is_gil_enabled = getattr( sys, '_is_gil_enabled', None );
+    if is_gil_enabled is not None:
+        return is_gil_enabled();
+    return not sysconfig.get_config_var( 'Py_GIL_DISABLED' );
+
+
+# Processor owned by a ProcessPoolExecutor worker, set by _init_worker
+_worker_processor = None;
+
+
+def _init_worker( processor: 'DicomSARProcessor' ):
+    """Initialize a worker process with its own copy of the processor"""
+    global _worker_processor;
+    _worker_processor = processor;
+    
+    # Records go back to the parent's log listener, which owns the log files
+    processor._attach_log_queue();
+
+
+def _worker_process( file_paths: List[Path] ) -> List[Optional[Dict]]:
+    """ProcessPoolExecutor entry point, processes one batch of files"""
+    return _worker_processor._process_batch( file_paths );
+
+
+def _batched( iterable: Iterable, n: int ) -> Iterator[List]:
+    """Yield lists of up to n items from iterable"""
+    it = iter( iterable );
+    while batch := list( itertools.islice( it, n ) ):
+        yield batch;
+
+
+def _submit_bounded( executor, task, batches: Iterable[List], window: int ) -> Iterator[Tuple]:
+    """Submit task( batch ) for every batch, keeping at most `window` tasks in flight
+    
+    Yields ( future, batch ) pairs as they complete so the number of live futures
+    stays bounded regardless of how many files were discovered.
+    """
+    pending = {};
+    for batch in batches:
+        if len( pending ) >= window:
+            done, _ = wait( pending, return_when=FIRST_COMPLETED );
+            for future in done:
+                yield future, pending.pop( future );
+        pending[executor.submit( task, batch )] = batch;
+    
+    for future in as_completed( pending ):
+        yield future, pending[future];
+
+
+def _literal_pattern( search: str, replace: str ) -> Optional[str]:
+    """Return the search string if the substitution is a plain literal replace, else None"""
+    if not search or REGEX_METACHARS.intersection( search ):
+        return None;
+    
+    # Backslashes in the replacement are escapes/backreferences for re.sub
+    if '\\' in replace:
+        return None;
+    
+    return search;
+
+
+def _sar_elements( elements: Iterable, search_re, literal: Optional[str], replace: str,
+                   max_lengths: Dict[str, int], dry_run: bool ) -> Tuple[List, List, List]:
+    """Search/replace over string elements, the SAR hot loop
+    
+    Returns ( changes, too_long, failed ): ( elem, old, new ) for each applied change,
+    elements whose new value would exceed the VR max length, and ( elem, exception )
+    for elements that could not be processed. _sar_accel.pyx mirrors this function.
+    """
+    changes = [];
+    too_long = [];
+    failed = [];
+    search = search_re.search;
+    sub = search_re.sub;
+    
+    for elem in elements:
+        try:
+            raw = elem.value;
+            if isinstance( raw, bytes ):
+                # Undecoded byte values are never substituted
+                continue;
+            
+            # Avoid an extra str() allocation when the value is already a str
+            old_value = raw if isinstance( raw, str ) else str( raw );
+            
+            # Most elements don't match; skip the substitution walk for those
+            if literal is not None:
+                if literal not in old_value:
+                    continue;
+                new_value = old_value.replace( literal, replace );
+            else:
+                if search( old_value ) is None:
+                    continue;
+                new_value = sub( replace, old_value );
+            
+            if new_value == old_value:
+                continue;
+            
+            # Validate VR length constraints
+            max_len = max_lengths.get( elem.VR );
+            if max_len is not None and len( new_value ) > max_len:
+                too_long.append( elem );
+                continue;
+            
+            if not dry_run:
+                elem.value = new_value;
+            
+            changes.append( ( elem, old_value, new_value ) );
+        
+        except Exception as e:
+            failed.append( ( elem, e ) );
+    
+    return changes, too_long, failed;
+
+
+def _format_dump_value( elem, expand_sequences: bool = False ) -> str:
+    """Format an element value for dump output without stringifying binary data
+    
+    Sequences are summarized by their item count unless expand_sequences is set,
+    as when the sequence was explicitly requested with --tag.
+    """
+    vr = elem.VR;
+    value = elem.value;
+    
+    if vr in STRING_VRS:
+        return value if isinstance( value, str ) else str( value );
+    if vr in BINARY_VRS:
+        return f"<binary len={len( value ) if value else 0}>";
+    if vr == 'SQ' and not expand_sequences:
+        # Only top-level elements are dumped
+        return f"<sequence items={len( value )}>";
+    return str( value );
+
+
+def _string_elements( ds ) -> Iterator[DataElement]:
+    """Yield the top-level string-VR elements of ds
+    
+    VRs are taken from the raw entries so that skipped values, including deferred
+    ones, are never converted; iterating the dataset would reopen the file for each
+    deferred element.
+    """
+    raw_elements = ds._dict;
+    for tag in sorted( raw_elements ):
+        vr = raw_elements[tag].VR;
+        if vr is None or vr == 'UN':
+            # Implicit VR, or stored as UN: pydicom converts known tags to their
+            # dictionary VR on access. Unknown private tags need the full conversion.
+            try:
+                vr = dictionary_VR( tag );
+            except KeyError:
+                vr = ds[tag].VR;
+        if vr in STRING_VRS:
+            yield ds[tag];
+
+
+def _is_probably_dicom( file_path: Path ) -> bool:
+    """Cheap magic-byte check so non-DICOM files skip the full dcmread"""
+    try:
+        with open( file_path, 'rb' ) as f:
+            buf = f.read( 132 );
+    except OSError:
+        return False;
+    
+    # Part 10 file: 128 byte preamble followed by 'DICM'
+    if buf[128:132] == b'DICM':
+        return True;
+    
+    # Headerless dataset: first element is in group 0002 or 0008, little or big endian
+    return buf[:2] in ( b'\x02\x00', b'\x08\x00', b'\x00\x08' );
+
 
 class DicomSARProcessor:
     """Main processor for DICOM search/replace and dump operations"""
     
     def __init__( self, args ):
         self.args = args;
-        self.processed_count = 0;
-        self.modified_count = 0;
-        self.error_count = 0;
+        # Tallies ('processed', 'modified', 'skipped', 'errors') are only updated by the
+        # drain loop in run(); workers report through their result dicts
+        self.counts = Counter();
+        self.total_processing_time = 0.0;
         self.start_time = None;
-        self.processing_times = [];
+        
+        # Backup timestamp, computed once per run rather than per modified file
+        self._run_stamp = datetime.now().strftime( '%Y%m%d_%H%M%S' );
+        
+        # Threads only scale on the free-threaded build; with the GIL, dcmread and
+        # regex work serialize, so fall back to worker processes
+        self.use_processes = _gil_enabled();
         
         # Setup logging
         self._setup_logging();
@@ -64,12 +288,36 @@ class DicomSARProcessor:
         # Parse tags
         self.target_tags = self._parse_tags( args.tag ) if args.tag else None;
         
+        # Raw tag ints for O(1) membership tests while walking a dataset
+        self.target_tag_set = frozenset( int( tag ) for tag in self.target_tags ) if self.target_tags else frozenset();
+        
+        # Compile the search pattern once per run; pickled copies handed to worker
+        # processes are recompiled once per worker on unpickling
+        self._search_re = None;
+        if args.sar and args.regex_search:
+            try:
+                self._search_re = re.compile( args.regex_search );
+            except re.error as e:
+                self.logger.error( f"Invalid --regex_search pattern: {e}" );
+                sys.exit( 1 );
+        
+        # Literal patterns (e.g. a hospital name) skip the regex engine and use str.replace
+        # (see _sar_elements)
+        self._literal = None;
+        if self._search_re and args.regex_replace is not None:
+            self._literal = _literal_pattern( args.regex_search, args.regex_replace );
+            if self._literal is not None:
+                self.logger.debug( "Search pattern is a literal, using str.replace fast path" );
+        
         # Determine worker count
         self.worker_count = args.threads if args.threads else max( 1, os.cpu_count() - 4 );
-        self.logger.info( f"Using {self.worker_count} worker threads" );
+        self.logger.info( f"Using {self.worker_count} worker {'processes' if self.use_processes else 'threads'}" );
+        
+        if args.sar and _accel_sar_elements is not None:
+            self.logger.debug( "Using Cython SAR accelerator (_sar_accel)" );
     
     def _setup_logging( self ):
-        """Configure logging to file and console"""
+        """Configure logging to file through a background QueueListener and to the console"""
         log_dir = Path( __file__ ).parent / "logs";
         log_dir.mkdir( exist_ok=True );
         
@@ -77,33 +325,76 @@ class DicomSARProcessor:
         log_file = log_dir / "dicom_sar.log";
         error_log_file = log_dir / "errors.log";
         
-        # Configure root logger
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler( log_file ),
-                logging.StreamHandler( sys.stdout )
-            ]
+        formatter = logging.Formatter( '%(asctime)s - %(levelname)s - %(message)s' );
+        file_handler = logging.FileHandler( log_file );
+        
+        # Only the main thread prints directly, so worker threads never wait on the
+        # stdout handler lock; their console records go through the listener
+        main_pid, main_thread = os.getpid(), threading.get_ident();
+        is_main = lambda record: record.process == main_pid and record.thread == main_thread;
+        console_handler = logging.StreamHandler( sys.stdout );
+        console_handler.addFilter( is_main );
+        worker_console_handler = logging.StreamHandler( sys.stdout );
+        worker_console_handler.addFilter( lambda record: not is_main( record ) );
+        
+        # Error log only gets records from the error logger
+        error_handler = logging.FileHandler( error_log_file );
+        error_handler.setLevel( logging.ERROR );
+        error_handler.addFilter( logging.Filter( 'errors' ) );
+        
+        for handler in ( file_handler, console_handler, worker_console_handler, error_handler ):
+            handler.setFormatter( formatter );
+        
+        # Loggers only enqueue records; the listener thread does the handler I/O, so
+        # workers never serialize on handler locks or file writes. Worker processes need a queue
+        # that crosses process boundaries.
+        self._log_queue = multiprocessing.Queue() if self.use_processes else SimpleQueue();
+        self._log_listener = QueueListener(
+            self._log_queue, file_handler, worker_console_handler, error_handler, respect_handler_level=True
         );
+        self._log_listener.start();
+        
+        # Stopping the listener flushes queued records, also on sys.exit()
+        atexit.register( self._log_listener.stop );
+        
+        self._attach_log_queue();
+        
+        # The main thread writes to the console directly, so its messages stay in
+        # order with the progress output and the final report
+        logging.getLogger().addHandler( console_handler );
+    
+    def _flush_log_listener( self ):
+        """Wait until the listener has handled every queued record"""
+        # stop() enqueues a sentinel and joins the thread once the queue is drained
+        self._log_listener.stop();
+        self._log_listener.start();
+    
+    def _attach_log_queue( self ):
+        """Route this process's logging through a QueueHandler on the log queue"""
+        root = logging.getLogger();
+        for handler in root.handlers[:]:
+            root.removeHandler( handler );
+        root.addHandler( QueueHandler( self._log_queue ) );
+        root.setLevel( logging.DEBUG );
         
         self.logger = logging.getLogger( __name__ );
         self.logger.setLevel( logging.INFO if not self.args.verbose else logging.DEBUG );
         
         # Error logger
         self.error_logger = logging.getLogger( 'errors' );
-        error_handler = logging.FileHandler( error_log_file );
-        error_handler.setLevel( logging.ERROR );
-        self.error_logger.addHandler( error_handler );
+    
+    def __getstate__( self ):
+        """Leave the log listener (it owns a thread) behind when pickled for worker processes"""
+        state = self.__dict__.copy();
+        state.pop( '_log_listener', None );
+        return state;
     
     def _parse_tags( self, tag_input: str ) -> List[Tag]:
         """Parse tag input supporting multiple formats: (0010,0020), 0010,0020, PatientID"""
         tags = [];
         
-        # Pattern to match tags in various formats
-        # Matches: (0010,0020), (0010, 0020), 0010,0020, 10,20, etc.
-        pattern = r'\(?\s*([0-9a-fA-F]+)\s*,\s*([0-9a-fA-F]+)\s*\)?';
-        matches = re.findall( pattern, tag_input );
+        # Match tags in various formats, see TAG_HEX_RE
+        matches = TAG_HEX_RE.findall( tag_input );
         
         for group, element in matches:
             try:
@@ -131,38 +422,102 @@ class DicomSARProcessor:
         
         return tags;
     
-    def _discover_files( self, path: Path ) -> List[Path]:
-        """Recursively discover all files in the given path"""
+    def _discover_files( self, path: Path ) -> Iterator[Path]:
+        """Recursively yield all files in the given path as they are found"""
         self.logger.info( f"Discovering files in: {path}" );
-        files = list( path.rglob( '*.*' ) );
-        self.logger.info( f"Found {len( files )} files" );
-        return files;
-    
-    def _validate_vr_length( self, value: str, vr: str ) -> bool:
-        """Validate that the value doesn't exceed VR length constraints"""
-        if vr in VR_MAX_LENGTHS:
-            max_len = VR_MAX_LENGTHS[vr];
-            if len( value ) > max_len:
-                return False;
-        return True;
+        
+        if path.is_file():
+            yield path;
+            return;
+        
+        # os.scandir over rglob: DirEntry caches the file type, and yielding lazily lets
+        # workers start before the walk finishes. Every file is matched (not '*.*')
+        # since many DICOM files have no extension.
+        stack = [ os.fspath( path ) ];
+        while stack:
+            try:
+                it = os.scandir( stack.pop() );
+            except OSError as e:
+                self.logger.warning( f"Cannot read directory: {e}" );
+                continue;
+            
+            with it:
+                for entry in it:
+                    if entry.is_dir( follow_symlinks=False ):
+                        stack.append( entry.path );
+                    elif entry.is_file() and not entry.name.endswith( TEMP_SUFFIX ):
+                        yield Path( entry.path );
+    
+    def _backup_original( self, file_path: Path, backup_file: Path ):
+        """Back up the original file, as a hardlink when possible"""
+        try:
+            # A hardlink costs no I/O; the original inode survives because
+            # _save_replacing writes the modified file to a new inode
+            os.link( file_path, backup_file );
+        except OSError:
+            # Cross-filesystem backup dir, or a filesystem without hardlinks
+            shutil.copy2( file_path, backup_file );
+    
+    def _save_replacing( self, ds, file_path: Path ):
+        """Atomically replace file_path with ds, via a temporary file in the same directory
+        
+        The original stays untouched until os.replace, so a crash never leaves a
+        half-written file, deferred values (PixelData) can still be read from it
+        while writing, and a hardlinked backup keeps the original inode. Symlinks
+        are resolved so the file they point to is replaced, not the link.
+        """
+        real_path = Path( os.path.realpath( file_path ) );
+        tmp = tempfile.NamedTemporaryFile(
+            dir=real_path.parent, prefix=f".{real_path.name}.", suffix=TEMP_SUFFIX, delete=False
+        );
+        
+        try:
+            # Write through the already open handle rather than reopening by name
+            with tmp:
+                ds.save_as( tmp );
+            if hasattr( os, 'chown' ):
+                st = real_path.stat();
+                try:
+                    os.chown( tmp.name, st.st_uid, st.st_gid );
+                except OSError:
+                    pass;  # best effort, only root may hand a file to another owner
+            shutil.copymode( real_path, tmp.name );  # temp files are created 0600
+            os.replace( tmp.name, real_path );
+        except BaseException:
+            os.unlink( tmp.name );
+            raise;
     
     def _process_dump( self, file_path: Path ) -> Optional[Dict]:
         """Process a file in dump mode"""
+        file_start = time.time();
+        
         try:
-            ds = pydicom.dcmread( str( file_path ), force=True );
+            # Dump only needs the header, skip PixelData entirely. With --tag, only the
+            # requested elements are decoded; the reader skips over the rest.
+            if self.target_tags and max( self.target_tags ) >= PIXEL_DATA_TAG:
+                # Tags at or past PixelData need the full read, deferring large values
+                ds = pydicom.dcmread(
+                    os.fspath( file_path ), force=True, defer_size='1 KB', specific_tags=self.target_tags
+                );
+            else:
+                ds = pydicom.dcmread(
+                    os.fspath( file_path ), force=True, stop_before_pixels=True,
+                    specific_tags=self.target_tags or None
+                );
             
             results = {};
             
             if self.target_tags:
-                # Dump only specified tags
-                for tag in self.target_tags:
-                    if tag in ds:
-                        elem = ds[tag];
-                        results[tag] = {
-                            'tag': str( tag ),
+                # Dump only specified tags, in one pass over the (already narrowed) dataset.
+                # The filter also drops SpecificCharacterSet, which specific_tags always adds.
+                tag_set = self.target_tag_set;
+                for elem in ds:
+                    if int( elem.tag ) in tag_set:
+                        results[elem.tag] = {
+                            'tag': str( elem.tag ),
                             'keyword': elem.keyword,
                             'vr': elem.VR,
-                            'value': str( elem.value )
+                            'value': _format_dump_value( elem, expand_sequences=True )
                         };
             else:
                 # Dump all tags
@@ -172,17 +527,29 @@ class DicomSARProcessor:
                             'tag': str( elem.tag ),
                             'keyword': elem.keyword,
                             'vr': elem.VR,
-                            'value': str( elem.value )
+                            'value': _format_dump_value( elem )
                         };
             
-            return { 'file': str( file_path ), 'tags': results };
+            return {
+                'file': str( file_path ),
+                'tags': results,
+                'modified': False,
+                'processing_time': time.time() - file_start
+            };
         
         except Exception as e:
             self.logger.error( f"Error dumping {file_path}: {e}" );
             self.error_logger.error( f"{file_path}: {e}" );
-            self.error_count += 1;
             return None;
     
+    def _process_batch( self, file_paths: List[Path] ) -> List[Optional[Dict]]:
+        """Process a batch of files in the current mode, one result per file"""
+        process = self._process_dump if self.args.dump else self._process_sar;
+        return [
+            process( f ) if _is_probably_dicom( f ) else { 'file': str( f ), 'skipped': True }
+            for f in file_paths
+        ];
+    
     def _process_sar( self, file_path: Path ) -> Optional[Dict]:
         """Process a file in search and replace mode"""
         file_start = time.time();
@@ -190,86 +557,82 @@ class DicomSARProcessor:
         changes = [];
         
         try:
-            ds = pydicom.dcmread( str( file_path ), force=True );
-            
-            # Determine which elements to process
-            elements_to_process = [];
+            # Large values (PixelData, LUTs) are only read if the file gets saved
+            ds = pydicom.dcmread( os.fspath( file_path ), force=True, defer_size='1 KB' );
             
+            # Determine which elements to process; lazily, so selection and
+            # substitution happen in a single pass without an intermediate list
             if self.target_tags:
                 # Process only specified tags
-                for tag in self.target_tags:
-                    if tag in ds:
-                        elements_to_process.append( ds[tag] );
+                elements_to_process = ( ds[tag] for tag in self.target_tags if tag in ds );
             else:
                 # Process all string-based VRs
-                string_vrs = { 'AE', 'AS', 'CS', 'DA', 'DS', 'DT', 'IS', 'LO', 'LT', 'PN', 'SH', 'ST', 'TM', 'UI' };
-                for elem in ds:
-                    if hasattr( elem, 'VR' ) and elem.VR in string_vrs:
-                        elements_to_process.append( elem );
+                elements_to_process = _string_elements( ds );
+                
+                if self._literal is not None:
+                    # A single substring search over all values joined together proves
+                    # most files have nothing to replace, without per-element checks.
+                    # A hit spanning the separator is only a false positive.
+                    elements_to_process = list( elements_to_process );
+                    joined = "\x1f".join( [ str( elem.value ) for elem in elements_to_process ] );
+                    if self._literal not in joined:
+                        elements_to_process = [];
             
             # Apply regex search and replace
-            for elem in elements_to_process:
-                try:
-                    old_value = str( elem.value );
-                    new_value = re.sub( self.args.regex_search, self.args.regex_replace, old_value );
-                    
-                    if new_value != old_value:
-                        # Validate VR length constraints
-                        if not self._validate_vr_length( new_value, elem.VR ):
-                            self.logger.warning(
-                                f"Skipping {file_path} tag {elem.tag}: new value exceeds VR {elem.VR} max length"
-                            );
-                            continue;
-                        
-                        if not self.args.dry_run:
-                            elem.value = new_value;
-                        
-                        modified = True;
-                        changes.append( {
-                            'tag': str( elem.tag ),
-                            'keyword': elem.keyword,
-                            'old': old_value,
-                            'new': new_value
-                        } );
-                
-                except Exception as e:
-                    self.logger.warning( f"Error processing element {elem.tag} in {file_path}: {e}" );
+            sar_elements = _accel_sar_elements or _sar_elements;
+            applied, too_long, failed = sar_elements(
+                elements_to_process, self._search_re, self._literal, self.args.regex_replace,
+                VR_MAX_LENGTHS, self.args.dry_run
+            );
+            
+            for elem, e in failed:
+                self.logger.warning( f"Error processing element {elem.tag} in {file_path}: {e}" );
+            
+            for elem in too_long:
+                self.logger.warning(
+                    f"Skipping {file_path} tag {elem.tag}: new value exceeds VR {elem.VR} max length"
+                );
+            
+            for elem, old_value, new_value in applied:
+                modified = True;
+                changes.append( {
+                    'tag': str( elem.tag ),
+                    'keyword': elem.keyword,
+                    'old': old_value,
+                    'new': new_value
+                } );
             
             # Save the file if modified
             if modified and not self.args.dry_run:
                 if self.args.inplace:
                     # Save in place
-                    ds.save_as( str( file_path ) );
+                    self._save_replacing( ds, file_path );
                 else:
                     # Save to backup directory with timestamp
                     backup_dir = Path( __file__ ).parent / "backup";
                     backup_dir.mkdir( exist_ok=True );
                     
-                    timestamp = datetime.now().strftime( '%Y%m%d_%H%M%S' );
-                    backup_file = backup_dir / f"{file_path.stem}.{timestamp}{file_path.suffix}";
+                    # Random suffix: files with the same name in different directories
+                    # would otherwise map to the same backup path
+                    backup_file = backup_dir / f"{file_path.stem}.{self._run_stamp}.{uuid.uuid4().hex[:8]}{file_path.suffix}";
                     
-                    # Copy original to backup
-                    shutil.copy2( file_path, backup_file );
+                    # Link (or copy) original to backup
+                    self._backup_original( file_path, backup_file );
                     
                     # Save modified version
-                    ds.save_as( str( file_path ) );
-                
-                self.modified_count += 1;
-            
-            self.processed_count += 1;
-            processing_time = time.time() - file_start;
-            self.processing_times.append( processing_time );
+                    self._save_replacing( ds, file_path );
             
+            # Counters are tallied by run() so they also work across worker processes
             return {
                 'file': str( file_path ),
                 'modified': modified,
-                'changes': changes
+                'changes': changes,
+                'processing_time': time.time() - file_start
             };
         
         except Exception as e:
             self.logger.error( f"Error processing {file_path}: {e}" );
             self.error_logger.error( f"{file_path}: {e}" );
-            self.error_count += 1;
             return None;
     
     def run( self ):
@@ -277,6 +640,11 @@ class DicomSARProcessor:
         self.start_time = time.time();
         
         # Validate arguments
+        if self.args.tag and not self.target_tags:
+            # Otherwise dump and --force SAR would silently fall back to all tags
+            self.logger.error( f"No valid tags in --tag: {self.args.tag}" );
+            sys.exit( 1 );
+        
         if self.args.sar:
             if not self.args.regex_search or not self.args.regex_replace:
                 self.logger.error( "SAR mode requires --regex_search and --regex_replace" );
@@ -292,68 +660,111 @@ class DicomSARProcessor:
             self.logger.error( f"Path does not exist: {path}" );
             sys.exit( 1 );
         
+        # Discovery is streamed straight into the executor
         files = self._discover_files( path );
         
-        if not files:
-            self.logger.warning( "No files found to process" );
-            return;
-        
         # Process files
-        self.logger.info( f"Processing {len( files )} files with {self.worker_count} workers" );
+        self.logger.info( f"Processing files with {self.worker_count} workers" );
         
-        results = [];
+        if self.use_processes:
+            # Files go out as paths and only the small result dicts come back
+            executor = ProcessPoolExecutor(
+                max_workers=self.worker_count, initializer=_init_worker, initargs=( self, )
+            );
+            task = _worker_process;
+            chunksize = PROCESS_CHUNKSIZE;
+        else:
+            executor = ThreadPoolExecutor( max_workers=self.worker_count );
+            task = self._process_batch;
+            chunksize = 1;  # no IPC to amortize, one file per task balances best
         
-        with ThreadPoolExecutor( max_workers=self.worker_count ) as executor:
-            # Submit all tasks
-            if self.args.dump:
-                futures = { executor.submit( self._process_dump, f ): f for f in files };
-            else:  # SAR mode
-                futures = { executor.submit( self._process_sar, f ): f for f in files };
-            
-            # Process with progress bar
-            with tqdm( total=len( files ), desc="Processing files", unit="file" ) as pbar:
-                for future in as_completed( futures ):
-                    result = future.result();
-                    if result:
-                        results.append( result );
-                        
-                        # Print dump results
-                        if self.args.dump and result.get( 'tags' ):
-                            print( f"\n{result['file']}:" );
-                            for tag_data in result['tags'].values():
-                                print( f"  {tag_data['tag']} {tag_data['keyword']} [{tag_data['vr']}]: {tag_data['value']}" );
-                        
-                        # Print SAR changes
-                        elif self.args.sar and result.get( 'modified' ):
-                            if self.args.dry_run:
-                                print( f"\n[DRY RUN] {result['file']}:" );
-                            else:
-                                print( f"\n{result['file']}:" );
+        # Progress and console output are flushed in bursts rather than per file,
+        # so tqdm's lock and the stdout lock aren't taken for every result
+        pending_files = 0;
+        lines = [];
+        last_flush = time.monotonic();
+        
+        with executor:
+            # Process with progress bar; only worker_count * 4 batches are queued at a time
+            with tqdm( desc="Processing files", unit="file", mininterval=0.2, miniters=PROGRESS_BATCH ) as pbar:
+                for future, batch in _submit_bounded( executor, task, _batched( files, chunksize ), self.worker_count * 4 ):
+                    for result in future.result():
+                        if not result:
+                            self.counts['errors'] += 1;
+                        elif result.get( 'skipped' ):
+                            self.logger.debug( f"Skipped non-DICOM file: {result['file']}" );
+                            self.counts['skipped'] += 1;
+                        else:
+                            self.counts['processed'] += 1;
+                            self.total_processing_time += result['processing_time'];
+                            
+                            if result['modified'] and not self.args.dry_run:
+                                self.counts['modified'] += 1;
                             
-                            for change in result.get( 'changes', [] ):
-                                print( f"  {change['tag']} {change['keyword']}: '{change['old']}' -> '{change['new']}'" );
+                            # Collect dump results
+                            if self.args.dump and result.get( 'tags' ):
+                                lines.append( f"\n{result['file']}:\n" );
+                                for tag_data in result['tags'].values():
+                                    lines.append( f"  {tag_data['tag']} {tag_data['keyword']} [{tag_data['vr']}]: {tag_data['value']}\n" );
+                            
+                            # Collect SAR changes
+                            elif self.args.sar and result.get( 'modified' ):
+                                if self.args.dry_run:
+                                    lines.append( f"\n[DRY RUN] {result['file']}:\n" );
+                                else:
+                                    lines.append( f"\n{result['file']}:\n" );
+                                
+                                for change in result.get( 'changes', [] ):
+                                    lines.append( f"  {change['tag']} {change['keyword']}: '{change['old']}' -> '{change['new']}'\n" );
                     
-                    pbar.update( 1 );
+                    pending_files += len( batch );
+                    now = time.monotonic();
+                    if pending_files >= PROGRESS_BATCH or now - last_flush >= FLUSH_INTERVAL:
+                        self._flush_output( lines, pbar, pending_files );
+                        pending_files = 0;
+                        last_flush = now;
+                
+                self._flush_output( lines, pbar, pending_files );
+        
+        # Worker records still queued would otherwise print into the report
+        self._flush_log_listener();
+        
+        if not pbar.n:
+            self.logger.warning( "No files found to process" );
+            return;
+        
+        self.logger.info( f"Found {pbar.n} files" );
         
         # Print final report
         self._print_report();
     
+    def _flush_output( self, lines: List[str], pbar, pending_files: int ):
+        """Write buffered console lines in one call and advance the progress bar"""
+        if lines:
+            sys.stdout.write( "".join( lines ) );
+            sys.stdout.flush();
+            lines.clear();
+        if pending_files:
+            pbar.update( pending_files );
+    
     def _print_report( self ):
         """Print final execution report"""
         total_time = time.time() - self.start_time;
-        avg_time = sum( self.processing_times ) / len( self.processing_times ) if self.processing_times else 0;
+        processed = self.counts['processed'];
+        avg_time = self.total_processing_time / processed if processed else 0;
         
         print( "\n" + "=" * 60 );
         print( "EXECUTION REPORT" );
         print( "=" * 60 );
-        print( f"Files processed: {self.processed_count}" );
+        print( f"Files processed: {processed}" );
         
         if self.args.sar:
-            print( f"Files modified: {self.modified_count}" );
+            print( f"Files modified: {self.counts['modified']}" );
             if self.args.dry_run:
                 print( "[DRY RUN MODE - No changes written]" );
         
-        print( f"Errors: {self.error_count}" );
+        print( f"Skipped (not DICOM): {self.counts['skipped']}" );
+        print( f"Errors: {self.counts['errors']}" );
         print( f"Average processing time: {avg_time:.4f}s per file" );
         print( f"Total execution time: {total_time:.2f}s" );
         print( "=" * 60 );
@@ -0,0 +1,67 @@
+"""
+Parity check between the pure Python SAR loop and the optional Cython build
+
+Skipped unless _sar_accel has been built (cythonize -i _sar_accel.pyx).
+"""
+
+import re;
+import sys;
+from pathlib import Path;
+
+import pytest;
+
+sys.path.insert( 0, str( Path( __file__ ).resolve().parent.parent ) );
+
+import dicom_sar;
+from pydicom.dataelem import DataElement;
+from pydicom.uid import UID;
+from pydicom.valuerep import PersonName;
+
+_sar_accel = pytest.importorskip( '_sar_accel' );
+
+
+def _make_elements():
+    """One element per value type the SAR loop has to handle"""
+    return [
+        DataElement( 0x00100020, 'LO', '1CT1' ),                                   # str
+        DataElement( 0x00080018, 'UI', UID( '1.3.6.1.4.1.5962.1.1.1' ) ),          # UID (str subclass)
+        DataElement( 0x00100010, 'PN', PersonName( 'CompressedSamples^CT1' ) ),   # PersonName
+        DataElement( 0x00080008, 'CS', [ 'ORIGINAL', 'PRIMARY', 'AXIAL' ] ),       # MultiValue
+        DataElement( 0x00091001, 'LO', b'1CT1' ),                                  # bytes
+        DataElement( 0x00080050, 'SH', '1' * 16 ),                                 # exceeds SH max length
+    ];
+
+
+def _summarize( result ):
+    """Make loop results comparable across element instances"""
+    changes, too_long, failed = result;
+    return (
+        [ ( int( elem.tag ), old, new ) for elem, old, new in changes ],
+        [ int( elem.tag ) for elem in too_long ],
+        [ ( int( elem.tag ), type( e ) ) for elem, e in failed ],
+    );
+
+
+@pytest.mark.parametrize( 'search, replace', [
+    ( r'^(1)', r'X\1' ),      # regex path
+    ( 'C', 'Z' ),             # literal str.replace path
+    ( 'PRIMARY', 'SECOND' ),  # only matches inside the MultiValue
+] )
+@pytest.mark.parametrize( 'dry_run', [ True, False ] )
+def test_accel_matches_python( search, replace, dry_run ):
+    search_re = re.compile( search );
+    literal = dicom_sar._literal_pattern( search, replace );
+    
+    py_elements = _make_elements();
+    cy_elements = _make_elements();
+    
+    expected = dicom_sar._sar_elements(
+        py_elements, search_re, literal, replace, dicom_sar.VR_MAX_LENGTHS, dry_run
+    );
+    actual = _sar_accel.sar_elements(
+        cy_elements, search_re, literal, replace, dicom_sar.VR_MAX_LENGTHS, dry_run
+    );
+    
+    assert _summarize( actual ) == _summarize( expected );
+    assert not expected[2];
+    assert [ str( e.value ) for e in cy_elements ] == [ str( e.value ) for e in py_elements ];